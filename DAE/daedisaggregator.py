@@ -6,13 +6,20 @@ import matplotlib.pyplot as plt
 
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import h5py
+import tensorflow as tf
 import random
 import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from keras.models import load_model
 from keras.models import Sequential
 from keras.layers import Dense, Flatten, Conv1D, Reshape, Dropout
+from keras.optimizers import Adam
+from keras import mixed_precision
 from keras.utils import plot_model
 
 from nilmtk.utils import find_nearest
@@ -20,6 +27,31 @@ from nilmtk.feature_detectors import cluster
 from nilmtk.disaggregate import Disaggregator
 from nilmtk.datastore import HDFDataStore
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _finalize_numpy(pred, out, mmax):
+    '''Denormalizes and clips predictions with numpy, writing into out
+    '''
+    np.multiply(pred, mmax, out=out)
+    np.maximum(out, 0, out=out)
+
+if njit is not None:
+    @njit(cache=True)
+    def _finalize(pred, out, mmax):
+        '''Denormalizes and clips predictions in a single pass, writing into out
+        '''
+        for i in range(out.size):
+            v = pred[i] * mmax
+            # NaNs pass through, as with np.maximum in the numpy fallback
+            out[i] = 0.0 if v < 0 else v
+else:
+    _finalize = _finalize_numpy
+
+
 class DAEDisaggregator(Disaggregator):
     '''Denoising Autoencoder disaggregator from Neural NILM
     https://arxiv.org/pdf/1507.06594.pdf
@@ -32,23 +64,41 @@ class DAEDisaggregator(Disaggregator):
 
     MIN_CHUNK_LENGTH : int
        the minimum length of an acceptable chunk
+    BATCH_SIZE : int
+       the number of windows passed to the model at once during inference
+    WRITE_BUFFER_LENGTH : int
+       the number of output rows buffered before appending to the datastore
+    INFERENCE_BUFFER_LENGTH : int
+       the number of windows from consecutive chunks predicted together
+    SHUFFLE_BUFFER_LENGTH : int
+       the number of samples whose windows are shuffled together in training
     '''
 
-    def __init__(self, sequence_length):
+    def __init__(self, sequence_length, dtype_policy=None, dense_rank=None):
         '''Initialize disaggregator
 
         Parameters
         ----------
         sequence_length : the size of window to use on the aggregate data
         meter : a nilmtk.ElecMeter meter of the appliance to be disaggregated
+        dtype_policy : keras dtype policy for the fully connected layers,
+            e.g. 'mixed_bfloat16' or 'mixed_float16'. Defaults to float32
+        dense_rank : if set, the first fully connected layer is replaced by a
+            low rank factorization of this rank, e.g. 128. Defaults to the
+            full layer described in the paper
         '''
         self.MODEL_NAME = "AUTOENCODER"
         self.mmax = None
         self.sequence_length = sequence_length
         self.MIN_CHUNK_LENGTH = sequence_length
-        self.model = self._create_model(self.sequence_length)
-
-    def train(self, mains, meter, epochs=1, batch_size=16, **load_kwargs):
+        self.BATCH_SIZE = 256
+        self.WRITE_BUFFER_LENGTH = 1000000
+        self.INFERENCE_BUFFER_LENGTH = 16 * self.BATCH_SIZE
+        self.SHUFFLE_BUFFER_LENGTH = 1000000
+        self.model = self._create_model(self.sequence_length, dtype_policy, dense_rank)
+        self._predict_fn = None
+
+    def train(self, mains, meter, epochs=1, batch_size=16, shuffle_buffer=None, **load_kwargs):
         '''Train
 
         Parameters
@@ -56,29 +106,59 @@ class DAEDisaggregator(Disaggregator):
         mains : a nilmtk.ElecMeter object for the aggregate data
         meter : a nilmtk.ElecMeter object for the meter data
         epochs : number of epochs to train
+        batch_size : size of batch used for training
+        shuffle_buffer : number of windows shuffled together. Defaults to the
+            windows of SHUFFLE_BUFFER_LENGTH samples. Windows are streamed
+            in time order, so only windows within this bounded buffer are
+            mixed, unlike shuffling a whole chunk, which is usually a whole
+            section
         **load_kwargs : keyword arguments passed to `meter.power_series()`
+
+        Note: epochs are passes over the whole stream of chunks, not repeats
+        of every chunk
         '''
 
+        # Stream windows from every chunk so that reading the next chunk
+        # overlaps with training on the current one
+        s = self.sequence_length
+        if shuffle_buffer is None:
+            shuffle_buffer = (self.SHUFFLE_BUFFER_LENGTH + s - 1) // s
+        spec = tf.TensorSpec((s, 1), tf.float32)
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self._window_gen(mains, meter, **load_kwargs),
+            output_signature=(spec, spec))
+        dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+        self.model.fit(dataset, epochs=epochs)
+
+    def _window_gen(self, mains, meter, **load_kwargs):
+        '''Yields normalized training windows chunk by chunk
+
+        Parameters
+        ----------
+        mains : a nilmtk.ElecMeter object for the aggregate data
+        meter : a nilmtk.ElecMeter object for the meter data
+        **load_kwargs : keyword arguments passed to `meter.power_series()`
+
+        Yields: (X, Y) pairs of np.ndarray windows of shape (sequence_length, 1)
+        '''
         main_power_series = mains.power_series(**load_kwargs)
         meter_power_series = meter.power_series(**load_kwargs)
 
-        # Train chunks
-        run = True
-        mainchunk = next(main_power_series)
-        meterchunk = next(meter_power_series)
-        if self.mmax == None:
-            self.mmax = mainchunk.max()
+        for mainchunk, meterchunk in zip(main_power_series, meter_power_series):
+            # Take mmax from the first chunk, as it is read anyway
+            if self.mmax == None:
+                self.mmax = np.float32(mainchunk.max())
 
-        while(run):
             mainchunk = self._normalize(mainchunk, self.mmax)
             meterchunk = self._normalize(meterchunk, self.mmax)
+            mainvalues, metervalues = self._align(mainchunk, meterchunk)
 
-            self.train_on_chunk(mainchunk, meterchunk, epochs, batch_size)
-            try:
-                mainchunk = next(main_power_series)
-                meterchunk = next(meter_power_series)
-            except:
-                run = False
+            X_batch = self._to_windows(mainvalues)
+            Y_batch = self._to_windows(metervalues)
+            for X, Y in zip(X_batch, Y_batch):
+                yield X, Y
 
     def train_on_chunk(self, mainchunk, meterchunk, epochs, batch_size):
         '''Train using only one chunk
@@ -90,25 +170,14 @@ class DAEDisaggregator(Disaggregator):
         epochs : number of epochs for training
         '''
 
-        s = self.sequence_length
         #up_limit =  min(len(mainchunk), len(meterchunk))
         #down_limit =  max(len(mainchunk), len(meterchunk))
 
-        # Replace NaNs with 0s
-        mainchunk.fillna(0, inplace=True)
-        meterchunk.fillna(0, inplace=True)
-        ix = mainchunk.index.intersection(meterchunk.index)
-        mainchunk = mainchunk[ix]
-        meterchunk = meterchunk[ix]
+        mainvalues, metervalues = self._align(mainchunk, meterchunk)
 
         # Create array of batches
-        #additional = s - ((up_limit-down_limit) % s)
-        additional = s - (len(ix) % s)
-        X_batch = np.append(mainchunk, np.zeros(additional))
-        Y_batch = np.append(meterchunk, np.zeros(additional))
-
-        X_batch = np.reshape(X_batch, (int(len(X_batch) / s), s, 1))
-        Y_batch = np.reshape(Y_batch, (int(len(Y_batch) / s), s, 1))
+        X_batch = self._to_windows(mainvalues)
+        Y_batch = self._to_windows(metervalues)
 
         self.model.fit(X_batch, Y_batch, batch_size=batch_size, epochs=epochs, shuffle=True)
 
@@ -131,21 +200,20 @@ class DAEDisaggregator(Disaggregator):
             mainchunks[i] = next(mainps[i])
             meterchunks[i] = next(meterps[i])
         if self.mmax == None:
-            self.mmax = max([m.max() for m in mainchunks])
+            self.mmax = np.float32(max([m.max() for m in mainchunks]))
 
 
-        run = True
-        while(run):
+        while True:
             mainchunks = [self._normalize(m, self.mmax) for m in mainchunks]
             meterchunks = [self._normalize(m, self.mmax) for m in meterchunks]
 
             self.train_across_buildings_chunk(mainchunks, meterchunks, epochs, batch_size)
-            try:
-                for i in range(num_meters):
-                    mainchunks[i] = next(mainps[i])
-                    meterchunks[i] = next(meterps[i])
-            except:
-                run = False
+
+            # Stop as soon as any of the meters runs out of chunks
+            mainchunks = [next(ps, None) for ps in mainps]
+            meterchunks = [next(ps, None) for ps in meterps]
+            if any(m is None for m in mainchunks + meterchunks):
+                break
 
     def train_across_buildings_chunk(self, mainchunks, meterchunks, epochs, batch_size):
         num_meters = len(mainchunks)
@@ -172,8 +240,8 @@ class DAEDisaggregator(Disaggregator):
 
                 print("Batch {} of {}".format(bi,num_of_batches), end="\r")
                 sys.stdout.flush()
-                X_batch = np.empty((batch_size*num_meters, s, 1))
-                Y_batch = np.empty((batch_size*num_meters, s, 1))
+                X_batch = np.empty((batch_size*num_meters, s, 1), dtype=np.float32)
+                Y_batch = np.empty((batch_size*num_meters, s, 1), dtype=np.float32)
 
                 for i in range(num_meters):
                     mainpart = mainchunks[i]
@@ -192,7 +260,7 @@ class DAEDisaggregator(Disaggregator):
                 self.model.train_on_batch(X_batch, Y_batch)
             print("\n")
 
-    def disaggregate(self, mains, output_datastore, meter_metadata, **load_kwargs):
+    def disaggregate(self, mains, output_datastore, meter_metadata, write_mains=True, **load_kwargs):
         '''Disaggregate mains according to the model learnt.
 
         Parameters
@@ -201,6 +269,8 @@ class DAEDisaggregator(Disaggregator):
         output_datastore : instance of nilmtk.DataStore subclass
             For storing power predictions from disaggregation algorithm.
         meter_metadata : metadata for the produced output
+        write_mains : whether to copy the aggregate data to the output. Set to
+            False when output_datastore already contains it
         **load_kwargs : key word arguments
             Passed to `mains.power_series(**kwargs)`
         '''
@@ -213,34 +283,74 @@ class DAEDisaggregator(Disaggregator):
         timeframes = []
         building_path = '/building{}'.format(mains.building())
         mains_data_location = building_path + '/elec/meter1'
+        key = '{}/elec/meter{}'.format(building_path, meter_metadata.instance())
         data_is_available = False
 
-        for chunk in mains.power_series(**load_kwargs):
-            if len(chunk) < self.MIN_CHUNK_LENGTH:
-                continue
-            print("New sensible chunk: {}".format(len(chunk)))
-
-            timeframes.append(chunk.timeframe)
-            measurement = chunk.name
-            chunk2 = self._normalize(chunk, self.mmax)
-
-            appliance_power = self.disaggregate_chunk(chunk2)
-            appliance_power[appliance_power < 0] = 0
-            appliance_power = self._denormalize(appliance_power, self.mmax)
-
-            # Append prediction to output
-            data_is_available = True
-            cols = pd.MultiIndex.from_tuples([chunk.name])
-            meter_instance = meter_metadata.instance()
-            df = pd.DataFrame(
-                appliance_power.values, index=appliance_power.index,
-                columns=cols, dtype="float32")
-            key = '{}/elec/meter{}'.format(building_path, meter_instance)
-            output_datastore.append(key, df)
-
-            # Append aggregate data to output
-            mains_df = pd.DataFrame(chunk, columns=cols, dtype="float32")
-            output_datastore.append(key=mains_data_location, value=mains_df)
+        # Output is buffered and appended in large blocks to limit HDF5 writes
+        pred_buffer = []
+        mains_buffer = []
+        buffered = 0
+
+        # Reads are prefetched and writes run in the background so that HDF5
+        # I/O overlaps with inference. The lock serializes all HDF5 access,
+        # as PyTables is not safe to use from several threads at once
+        lock = threading.Lock()
+        writes = []
+        writer = ThreadPoolExecutor(max_workers=1)
+
+        def flush(pred_buffer, mains_buffer):
+            # Keep a single flush in flight: wait for the previous one, which
+            # also surfaces its failures, before queueing the next
+            for write in writes:
+                write.result()
+            del writes[:]
+            writes.append(writer.submit(
+                self._flush, output_datastore, key, pred_buffer, lock))
+            writes.append(writer.submit(
+                self._flush, output_datastore, mains_data_location, mains_buffer, lock))
+
+        chunks = self._prefetch(mains.power_series(**load_kwargs), lock)
+        stream = self._disaggregate_stream(chunks)
+        try:
+            for chunk, power in stream:
+                timeframes.append(chunk.timeframe)
+                measurement = chunk.name
+
+                # Append prediction to output
+                data_is_available = True
+                cols = pd.MultiIndex.from_tuples([chunk.name])
+                # power is already float32, wrap it as the single column
+                df = pd.DataFrame(
+                    power.reshape(-1, 1), index=chunk.index,
+                    columns=cols, copy=False)
+                pred_buffer.append(df)
+
+                # Append aggregate data to output
+                if write_mains:
+                    mainvalues = np.asarray(chunk.values, dtype=np.float32)
+                    mains_df = pd.DataFrame(
+                        mainvalues.reshape(-1, 1), index=chunk.index,
+                        columns=cols, copy=False)
+                    mains_buffer.append(mains_df)
+
+                buffered += len(df)
+                if buffered >= self.WRITE_BUFFER_LENGTH:
+                    flush(pred_buffer, mains_buffer)
+                    pred_buffer = []
+                    mains_buffer = []
+                    buffered = 0
+
+            flush(pred_buffer, mains_buffer)
+            for write in writes:
+                write.result()
+        finally:
+            # Stop reading and drop queued writes so nothing touches the
+            # datastores once this returns or raises
+            stream.close()
+            chunks.close()
+            for write in writes:
+                write.cancel()
+            writer.shutdown(wait=True)
 
         # Save metadata to output
         if data_is_available:
@@ -265,17 +375,13 @@ class DAEDisaggregator(Disaggregator):
             disaggregated appliance.  Column names are the integer index
             into `self.model` for the appliance in question.
         '''
-        s = self.sequence_length
         up_limit = len(mains)
 
         mains.fillna(0, inplace=True)
 
-        additional = s - (up_limit % s)
-        X_batch = np.append(mains, np.zeros(additional))
-        X_batch = np.reshape(X_batch, (int(len(X_batch) / s), s ,1))
+        X_batch = self._to_windows(mains.values)
 
-        pred = self.model.predict(X_batch)
-        pred = np.reshape(pred, (up_limit + additional))[:up_limit]
+        pred = self._predict(X_batch)[:up_limit]
         column = pd.Series(pred, index=mains.index, name=0)
 
         appliance_powers_dict = {}
@@ -284,6 +390,143 @@ class DAEDisaggregator(Disaggregator):
         return appliance_powers
 
 
+    def _disaggregate_stream(self, chunks):
+        '''Disaggregates a stream of mains chunks, predicting several
+        consecutive chunks with the same model calls
+
+        Parameters
+        ----------
+        chunks : iterable of pd.Series of the aggregate data
+
+        Yields: (chunk, appliance power) pairs in the order of chunks, where
+            appliance power is a denormalized float32 np.ndarray
+        '''
+        pending = []
+        nwindows = 0
+        s = self.sequence_length
+        for chunk in chunks:
+            if len(chunk) < self.MIN_CHUNK_LENGTH:
+                continue
+            print("New sensible chunk: {}".format(len(chunk)))
+
+            pending.append(chunk)
+            nwindows += (len(chunk) + s - 1) // s
+            if nwindows >= self.INFERENCE_BUFFER_LENGTH:
+                for item in zip(pending, self._disaggregate_chunks(pending)):
+                    yield item
+                pending = []
+                nwindows = 0
+
+        if pending:
+            for item in zip(pending, self._disaggregate_chunks(pending)):
+                yield item
+
+    def _disaggregate_chunks(self, chunks):
+        '''Disaggregates several mains chunks with a single `_predict` call
+
+        Parameters
+        ----------
+        chunks : list of pd.Series of the aggregate data
+
+        Returns: list with the denormalized appliance power of each chunk,
+            as float32 np.ndarray
+        '''
+        s = self.sequence_length
+        offsets = [0]
+        for chunk in chunks:
+            offsets.append(offsets[-1] + (len(chunk) + s - 1) // s * s)
+
+        # Normalize every chunk straight into its slot of a shared zero
+        # padded buffer, then predict all their windows together
+        buf = np.zeros(offsets[-1], dtype=np.float32)
+        for chunk, start in zip(chunks, offsets):
+            self._normalize_into(chunk.values, self.mmax, buf[start:start + len(chunk)])
+        pred = self._predict(buf.reshape(-1, s, 1))
+
+        powers = []
+        for chunk, start in zip(chunks, offsets):
+            power = np.empty(len(chunk), dtype=np.float32)
+            _finalize(pred[start:start + len(chunk)], power, self.mmax)
+            powers.append(power)
+        return powers
+
+    def _flush(self, output_datastore, key, buffer, lock):
+        '''Appends all buffered DataFrames to the datastore in one write
+
+        Parameters
+        ----------
+        output_datastore : instance of nilmtk.DataStore subclass
+        key : key of the datastore to append to
+        buffer : list of pd.DataFrame
+        lock : threading.Lock held while writing to the datastore
+        '''
+        if not buffer:
+            return
+        df = pd.concat(buffer)
+        with lock:
+            output_datastore.append(key=key, value=df)
+
+    def _prefetch(self, iterable, lock, size=2):
+        '''Reads items of an iterable ahead in a background thread
+
+        Parameters
+        ----------
+        iterable : iterable to read, e.g. the chunks of `power_series()`
+        lock : threading.Lock held while reading each item
+        size : maximum number of items read ahead
+
+        Yields: the items of iterable, in order. Exceptions raised while
+            reading are re-raised in the consuming thread. Closing the
+            generator stops the reader thread and closes the iterable
+        '''
+        items = queue.Queue(maxsize=size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # Give up once the consumer has stopped listening
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read():
+            it = None
+            error = None
+            try:
+                it = iter(iterable)
+                while not stop.is_set():
+                    with lock:
+                        item = next(it, done)
+                    if item is done or not put((item, None)):
+                        break
+            except BaseException as e:
+                error = e
+            finally:
+                if hasattr(it, 'close'):
+                    with lock:
+                        it.close()
+                put((done, error))
+
+        reader = threading.Thread(target=read)
+        reader.daemon = True
+        reader.start()
+
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is done:
+                    return
+                yield item
+        finally:
+            stop.set()
+            reader.join()
+
     def import_model(self, filename):
         '''Loads keras model from h5
 
@@ -294,51 +537,167 @@ class DAEDisaggregator(Disaggregator):
         Returns: Keras model
         '''
         self.model = load_model(filename)
-        with h5py.File(filename, 'a') as hf:
-            ds = hf.get('disaggregator-data').get('mmax')
-            self.mmax = np.array(ds)[0]
-
-    def export_model(self, filename):
+        if self.model.optimizer is None:
+            # Exported without the optimizer state, so it comes back uncompiled
+            self._compile(self.model)
+        self._predict_fn = None
+        with h5py.File(filename, 'r') as hf:
+            if 'mmax' in hf.attrs:
+                self.mmax = np.float32(hf.attrs['mmax'])
+            else:
+                # Models exported before mmax was stored as an attribute
+                self.mmax = np.float32(hf['disaggregator-data/mmax'][0])
+
+    def export_model(self, filename, include_optimizer=False):
         '''Saves keras model to h5
 
         Parameters
         ----------
         filename : filename for .h5 file
+        include_optimizer : whether to save the optimizer state as well, it
+            roughly doubles the file size. Without it `import_model` compiles
+            the model again with a fresh optimizer, so training continues
+            with reset Adam moments
         '''
-        self.model.save(filename)
+        self.model.save(filename, include_optimizer=include_optimizer)
         with h5py.File(filename, 'a') as hf:
-            gr = hf.create_group('disaggregator-data')
-            gr.create_dataset('mmax', data = [self.mmax])
+            hf.attrs['mmax'] = float(self.mmax)
+
+    def debug_plot(self, path='model.png'):
+        '''Draws the keras model to an image, requires pydot and graphviz
+
+        Parameters
+        ----------
+        path : filename for the image
+        '''
+        plot_model(self.model, to_file=path, show_shapes=True)
 
     def _normalize(self, chunk, mmax):
         '''Normalizes timeseries
 
         Parameters
         ----------
-        chunk : the timeseries to normalize
-        max : max value of the powerseries
+        chunk : the timeseries to normalize (pd.Series or np.ndarray)
+        mmax : max value of the powerseries
+
+        Returns: Normalized timeseries with NaNs replaced by 0s
+        '''
+        # Write into a fresh buffer so the caller's chunk is never modified
+        values = np.empty(len(chunk), dtype=np.float32)
+        self._normalize_into(np.asarray(chunk), mmax, values)
+        if isinstance(chunk, pd.Series):
+            return pd.Series(values, index=chunk.index, name=chunk.name)
+        return values
+
+    def _normalize_into(self, values, mmax, out):
+        '''Normalizes values into out in a single float32 pass
+
+        NaNs are replaced by 0s, as `fillna(0)` does. Infinite values are
+        kept.
+
+        Parameters
+        ----------
+        values : 1D np.ndarray of the timeseries
+        mmax : max value of the powerseries
+        out : float32 np.ndarray of the same length, written in place
+        '''
+        np.multiply(values, np.float32(1.0 / mmax), out=out)
+        out[np.isnan(out)] = 0
+
+    def _align(self, mainchunk, meterchunk):
+        '''Keeps only the timestamps present in both chunks
+
+        Parameters
+        ----------
+        mainchunk : chunk of site meter
+        meterchunk : chunk of appliance
 
-        Returns: Normalized timeseries
+        Returns: (mains, meter) np.ndarray values with NaNs replaced by 0s
         '''
-        tchunk = chunk / mmax
-        return tchunk
+        a = mainchunk.index.values.view('i8')
+        b = meterchunk.index.values.view('i8')
+        _, ia, ib = np.intersect1d(a, b, assume_unique=True, return_indices=True)
+
+        # Positional indexing already copies, so the NaNs are replaced in place
+        mainvalues = mainchunk.values[ia]
+        metervalues = meterchunk.values[ib]
+        mainvalues[np.isnan(mainvalues)] = 0
+        metervalues[np.isnan(metervalues)] = 0
+        return mainvalues, metervalues
 
-    def _denormalize(self, chunk, mmax):
-        '''Deormalizes timeseries
-        Note: This is not entirely correct
+    def _to_windows(self, values):
+        '''Splits a timeseries into zero padded windows of sequence_length
 
         Parameters
         ----------
-        chunk : the timeseries to denormalize
-        max : max value used for normalization
+        values : 1D np.ndarray of the timeseries
 
-        Returns: Denormalized timeseries
+        Returns: np.ndarray of shape (nwindows, sequence_length, 1)
         '''
-        tchunk = chunk * mmax
-        return tchunk
+        s = self.sequence_length
+        n = len(values)
+        nwindows = (n + s - 1) // s
+        buf = np.zeros(nwindows * s, dtype=np.float32)
+        buf[:n] = values
+
+        # Windows are a strided view over the padded buffer, no data is copied
+        step = buf.itemsize
+        return as_strided(buf, shape=(nwindows, s, 1), strides=(s * step, step, step))
+
+    def _predict(self, X_batch):
+        '''Runs the model on groups of exactly BATCH_SIZE windows
+
+        The last group is padded with zero windows, so the compiled predict
+        function only ever sees one input shape.
+
+        Parameters
+        ----------
+        X_batch : np.ndarray of shape (nwindows, sequence_length, 1)
 
-    def _create_model(self, sequence_len):
+        Returns: flat np.ndarray with the prediction for every sample
+        '''
+        # Compiled on first use, so building or importing a model that is
+        # only trained does not pay for an XLA compilation
+        if self._predict_fn is None:
+            self._predict_fn = self._create_predict_fn()
+
+        s = self.sequence_length
+        step = self.BATCH_SIZE
+        nwindows = len(X_batch)
+        pred = np.empty(nwindows * s, dtype=np.float32)
+
+        # Convert to a tensor once and slice it, rather than wrapping every group
+        X_batch = tf.constant(X_batch)
+        for start in range(0, nwindows, step):
+            stop = min(start + step, nwindows)
+            group = X_batch[start:stop]
+            if stop - start < step:
+                group = tf.pad(group, [[0, step - (stop - start)], [0, 0], [0, 0]])
+            out = self._predict_fn(group).numpy()[:stop - start]
+            pred[start * s:stop * s] = out.reshape(-1)
+        return pred
+
+    def _create_predict_fn(self):
+        '''Compiles inference for the current model with XLA
+
+        Returns: function mapping a (batch, sequence_length, 1) float32
+            tensor to the model predictions
+        '''
+        signature = [tf.TensorSpec((None, self.sequence_length, 1), tf.float32)]
+        return tf.function(lambda x: self.model(x, training=False),
+                           jit_compile=True, input_signature=signature)
+
+    def _create_model(self, sequence_len, dtype_policy=None, dense_rank=None):
         '''Creates the Auto encoder module described in the paper
+
+        Parameters
+        ----------
+        sequence_len : the size of window to use on the aggregate data
+        dtype_policy : keras dtype policy for the fully connected layers and
+            the dropout and reshape layers around them. The output layer
+            always runs in float32
+        dense_rank : rank of the factorization of the first fully connected
+            layer, None to keep it full
         '''
         model = Sequential()
 
@@ -347,22 +706,39 @@ class DAEDisaggregator(Disaggregator):
         model.add(Flatten())
 
         # Fully Connected Layers
-        model.add(Dropout(0.2))
-        model.add(Dense((sequence_len-0)*8, activation='relu'))
+        model.add(Dropout(0.2, dtype=dtype_policy))
+        if dense_rank is not None:
+            # Rank limited W = U V, cuts the (s*8)x(s*8) weight matrix down to
+            # 2 (s*8) dense_rank parameters
+            model.add(Dense(dense_rank, activation='linear', use_bias=False, dtype=dtype_policy))
+        model.add(Dense((sequence_len-0)*8, activation='relu', dtype=dtype_policy))
 
-        model.add(Dropout(0.2))
-        model.add(Dense(128, activation='relu'))
+        model.add(Dropout(0.2, dtype=dtype_policy))
+        model.add(Dense(128, activation='relu', dtype=dtype_policy))
 
-        model.add(Dropout(0.2))
-        model.add(Dense((sequence_len-0)*8, activation='relu'))
+        model.add(Dropout(0.2, dtype=dtype_policy))
+        model.add(Dense((sequence_len-0)*8, activation='relu', dtype=dtype_policy))
 
-        model.add(Dropout(0.2))
+        model.add(Dropout(0.2, dtype=dtype_policy))
 
         # 1D Conv
-        model.add(Reshape(((sequence_len-0), 8)))
-        model.add(Conv1D(1, 4, activation="linear", padding="same", strides=1))
+        model.add(Reshape(((sequence_len-0), 8), dtype=dtype_policy))
+        model.add(Conv1D(1, 4, activation="linear", padding="same", strides=1, dtype="float32"))
 
-        model.compile(loss='mse', optimizer='adam')
-        plot_model(model, to_file='model.png', show_shapes=True)
+        self._compile(model)
 
         return model
+
+    def _compile(self, model):
+        '''Compiles the model with the loss and optimizer used for training
+
+        Parameters
+        ----------
+        model : keras model to compile
+        '''
+        optimizer = Adam()
+        # Keras only adds loss scaling itself under a global float16 policy,
+        # the per layer policy needs it explicitly or gradients underflow
+        if any(getattr(layer, 'compute_dtype', None) == 'float16' for layer in model.layers):
+            optimizer = mixed_precision.LossScaleOptimizer(optimizer)
+        model.compile(loss='mse', optimizer=optimizer)